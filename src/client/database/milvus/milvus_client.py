@@ -1,9 +1,15 @@
 import os
 import sys
-import json
+import threading
 import traceback
+import weakref
+import asyncio
+import numpy as np
+import orjson
+from functools import lru_cache, partial
 from pymilvus import connections, FieldSchema, CollectionSchema, DataType,\
       Collection, utility, Partition
+from pymilvus.exceptions import SchemaNotReadyException
 from concurrent.futures import ThreadPoolExecutor
 from langchain.docstore.document import Document
 from typing import List
@@ -19,58 +25,173 @@ root_dir = os.path.dirname(root_dir)
 sys.path.append(root_dir)
 
 from src.utils.log_handler import debug_logger
-from src.utils.general_utils import get_time, cur_func_name
+from src.utils.general_utils import get_time, get_time_async, cur_func_name
 from src.configs.configs import MILVUS_HOST_LOCAL, MILVUS_PORT, VECTOR_SEARCH_TOP_K
 
+from src.client.database.milvus.milvus_utils import MilvusFailed, QueryCache, WriteBuffer, l2_normalize, \
+    as_query_embeddings, dumps_headers, loads_headers
 from src.client.embedding.embedding_client import SBIEmbeddings, _process_query, embed_user_input
 
 
-class MilvusFailed(Exception):
-    """异常基类"""
-    pass
-
-
 class MilvusClient:
+    # 向量维度，需与 embedding 模型输出一致
+    embedding_dim = 768
+    # VARCHAR 字段的最大长度（字节，UTF-8），Milvus 按此预留标量字段的缓冲区，应与实际分块大小匹配。
+    # 分块按 token 计数（默认父块 800 token），中文约 1~2 字/token、3 字节/字，4000 字节可容纳默认父块；
+    # 调小分块时可相应调小，仅对新建集合生效
+    content_max_length = 4000
+    headers_max_length = 256
+    # 本进程内已确认存在且建好索引的集合，命中时省去单独的 utility.has_collection 和 has_index 请求
+    # （Collection(name) 构造时 pymilvus 内部仍会 has_collection + describe 一次）
+    _known_collections: set = set()
+    _known_collections_lock = threading.Lock()
+    # 各实例共享同一用户的 Collection 句柄，已加载过的集合无需再次 describe/load
+    _collections = weakref.WeakValueDictionary()
+    # 各集合索引实际使用的度量方式和索引类型，如 {"metric_type": "L2", "index_type": "IVF_FLAT"}。
+    # 旧集合建的是 L2 + IVF_FLAT 索引、存的是未归一化向量，检索必须沿用 L2 并传 nprobe
+    _index_params: dict = {}
+    # 检索结果缓存由本进程内所有实例共享，任一实例写入后整体失效。
+    # 其他进程（如其他 Sanic worker）的写入无法感知，因此 TTL 取得较短，以此限制读到旧结果的时长
+    query_cache = QueryCache(max_size=1024, ttl_seconds=30)
+    # 固定实例属性，省去实例 __dict__，属性访问也更快
+    __slots__ = ('host', 'port', 'sess', 'partitions', 'executor', 'top_k', 'search_params', 'ivf_search_params',
+                 'create_params', '_buffer')
+
     def __init__(self):
         self.host = MILVUS_HOST_LOCAL
         self.port = MILVUS_PORT
         self.sess: Collection = None
         self.partitions: List[Partition] = []
-        # 可以先不用
-        self.executor = ThreadPoolExecutor(max_workers=4)
+        # 用于并发检索，pymilvus 在 gRPC 调用期间会释放 GIL
+        self.executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4)
         self.top_k = VECTOR_SEARCH_TOP_K
-        self.search_params = {"metric_type": "L2", "params": {"nprobe": 128}}
-        self.create_params = {"metric_type": "L2", "index_type": "IVF_FLAT", "params": {"nlist": 1024}}
+        # 写入缓冲区，攒够 1000 条后一次性 insert 到当前集合
+        self._buffer = WriteBuffer(self.insert_fields, self.embedding_dim, size=1000)
+        # HNSW 在单条查询、top_k 较小的场景下延迟明显低于 IVF 系列索引，ef 需不小于返回条数
+        # 新建集合使用内积（IP）度量，入库和查询的向量都先归一化，排序与 L2 相同；
+        # 已有集合以其索引的度量和类型为准，见 metric_type 和 index_type
+        self.search_params = {"metric_type": "IP", "params": {"ef": max(64, 2 * self.top_k)}}
+        self.create_params = {"metric_type": "IP", "index_type": "HNSW", "params": {"M": 16, "efConstruction": 200}}
+        # 已有的 IVF 系列索引（旧集合）检索时使用的参数，不传 nprobe 时 Milvus 默认只探查 8 个聚类，召回率明显下降
+        self.ivf_search_params = {"nprobe": 128}
+        # IVF_SQ8 在 Milvus 内部把 FP32 向量量化为 int8，索引体积约为 IVF_FLAT 的 1/4，数据量很大、内存吃紧时可考虑
+        # 使用 IVF 系列索引时，nlist 经验值为 4 * sqrt(n)（n 为向量数量），不低于 1024 且不超过 65536
+        # self.create_params = {"metric_type": "L2", "index_type": "IVF_SQ8", "params": {"nlist": 1024}}
+        # self.create_params = {"metric_type": "L2", "index_type": "IVF_PQ", "params": {"nlist": 1024, "m": 96, "nbits": 8}}  # 更大规模时可用 PQ 进一步压缩
+        # self.create_params = {"metric_type": "L2", "index_type": "IVF_FLAT", "params": {"nlist": 1024}}
         # self.create_params = {"metric_type": "L2", "index_type": "GPU_IVF_FLAT", "params": {"nlist": 1024}}  # GPU版本
         try:
-            connections.connect(host=self.host, 
-                                port=self.port,
-                                timeout=3, 
-                                timeout_retry=3, 
-                                wait_time=1)  # timeout=3 [cannot set]
+            self._connect(self.host, self.port)
         except Exception as e:
             debug_logger.error(f'[{cur_func_name()}] [MilvusClient] traceback = {traceback.format_exc()}')
 
+    @classmethod
+    @lru_cache(maxsize=None)
+    def _connect(cls, host, port):
+        """
+        每个进程对同一 host:port 只建立一次连接，所有 MilvusClient 实例复用 default 连接，避免请求处理中反复建连。
+        连接失败不会被缓存，下次实例化时重试。
+
+        keep_alive=True 会在 pymilvus 中注册 ReconnectHandler，连接空闲断开后自动重连；
+        gRPC 层的 keepalive 由 pymilvus 2.4.2 固定为 keepalive_time_ms=55000，无法通过 connect 参数修改。
+        """
+        connections.connect(alias="default",
+                            host=host,
+                            port=port,
+                            timeout=3,
+                            timeout_retry=3,
+                            wait_time=1,  # timeout=3 [cannot set]
+                            keep_alive=True)
+        return "default"
+
     @get_time 
     def load_collection_(self, user_id):
-        if not utility.has_collection(user_id):
-            schema = CollectionSchema(self.fields)
+        with MilvusClient._known_collections_lock:
+            known = user_id in MilvusClient._known_collections
+            collection = MilvusClient._collections.get(user_id)
+        if collection is not None:
+            # 其他实例已加载过该集合，直接复用句柄
+            self._switch_collection(collection)
+            return
+        collection = None
+        if known:
+            try:
+                collection = Collection(user_id)
+            except SchemaNotReadyException:
+                # 集合已被其他进程或管理员删除，移出已知集合，按未知集合重新检查/创建
+                with MilvusClient._known_collections_lock:
+                    MilvusClient._known_collections.discard(user_id)
+                    MilvusClient._index_params.pop(user_id, None)
+        # 已知集合此前已建好索引，无需再检查
+        if collection is None and not utility.has_collection(user_id):
+            # 以 kb_id 作为分区键，插入时按 hash(kb_id) 自动路由到分区，
+            # 检索表达式中带有 kb_id 条件时 Milvus 只扫描对应分区
+            schema = CollectionSchema(self.fields, partition_key_field="kb_id")
             debug_logger.info(f'create collection {user_id}')
-            collection = Collection(user_id, schema)
+            collection = Collection(user_id, schema, num_partitions=64)
             # 创建索引
             collection.create_index(field_name="embedding", index_params=self.create_params)
-        else:
+        elif collection is None:
             collection = Collection(user_id)
+            # 已有数据但尚未建索引的集合，补建索引。其中的向量未归一化，只能使用 L2
+            if not collection.has_index():
+                collection.create_index(field_name="embedding",
+                                        index_params={**self.create_params, "metric_type": "L2"})
+        with MilvusClient._known_collections_lock:
+            index_params = MilvusClient._index_params.get(user_id)
+        if index_params is None:
+            params = collection.index().params
+            index_params = {"metric_type": params["metric_type"], "index_type": params["index_type"]}
         collection.load()
+        with MilvusClient._known_collections_lock:
+            MilvusClient._known_collections.add(user_id)
+            MilvusClient._collections[user_id] = collection
+            MilvusClient._index_params[user_id] = index_params
+        self._switch_collection(collection)
+
+    def _switch_collection(self, collection: Collection):
+        # 缓冲区中的数据属于原集合，不能写入新集合，也不隐式 flush；调用方应在切换前自行 flush
+        discarded = self._buffer.bind(collection)
+        if discarded:
+            debug_logger.warning("discard %s unflushed documents of %s before loading %s",
+                                 discarded, self.sess.name if self.sess else None, collection.name)
         self.sess = collection
+
+    def drop_collection(self, user_id):
+        """删除集合，并使本进程内的集合存在性缓存失效。"""
+        if self.sess is not None and self.sess.name == user_id:
+            # 待写入的数据属于即将删除的集合，直接丢弃
+            self._buffer.bind(None)
+            self.sess = None
+        with MilvusClient._known_collections_lock:
+            MilvusClient._known_collections.discard(user_id)
+            MilvusClient._collections.pop(user_id, None)
+            MilvusClient._index_params.pop(user_id, None)
+        utility.drop_collection(user_id)
+        self.query_cache.invalidate_all()
         
-    def store_doc(self, doc: Document, embedding: List[float]):
+    def delete_files(self, file_ids: List[str]):
         """
-        将文档块存储到 Milvus 中。
+        删除当前集合中属于指定文件的全部文档块，用于清理入库失败的文件（store_doc 缓冲区满时会自动落库）。
+
+        Args:
+            file_ids (List[str]): 要删除的文件 ID 列表。
+        """
+        try:
+            if not self.sess:
+                raise MilvusFailed("Milvus collection is not loaded. Call load_collection_() first.")
+            self.sess.delete(expr=f"file_id in {list(file_ids)}")
+            self.query_cache.invalidate_all()
+        except Exception as e:
+            raise MilvusFailed(f"Failed to delete files: {str(e)}") from e
+
+    def store_doc(self, doc: Document, embedding: np.ndarray):
+        """
+        将文档块加入写入缓冲区，缓冲区满时自动写入 Milvus，剩余部分需调用 flush()。
 
         Args:
             doc (Document): Langchain 的 Document 对象，包含文档内容及其元数据。
-            embedding (List[float]): 文档的向量表示，长度为 768。
+            embedding (np.ndarray): 文档的向量表示，长度为 768，传入 List[float] 也会被转换为 float32 数组。
         """
         try:
             # 确保 Milvus 集合已加载
@@ -82,114 +203,268 @@ class MilvusClient:
             user_id = metadata.get('user_id')
             kb_id = metadata.get('kb_id')
             file_id = metadata.get('file_id')
-            headers = json.dumps(metadata.get('headers', {}))  # 将 headers 转换为 JSON 字符串
+            headers = dumps_headers(metadata.get('headers'))  # 将 headers 转换为 JSON 字符串
             doc_id = metadata.get('doc_id')
             content = doc.page_content
 
             # 检查字段是否完整
-            if not all([user_id, kb_id, file_id, doc_id, content, embedding]):
+            if not all([user_id, kb_id, file_id, doc_id, content]) or embedding is None:
                 raise MilvusFailed("Missing required fields in document metadata or embedding.")
+            emb = np.ascontiguousarray(embedding, dtype=np.float32)
+            if emb.shape != (self.embedding_dim,):
+                raise MilvusFailed(f"Embedding shape {emb.shape} does not match dim {self.embedding_dim}.")
+            if self.metric_type == "IP":
+                emb = l2_normalize(emb)
+
+            # 加入写入缓冲区（不需要提供主键值），攒够一批再插入
+            row = {'user_id': user_id, 'kb_id': kb_id, 'file_id': file_id, 'headers': headers,
+                   'doc_id': doc_id, 'content': content}
+            if self._buffer.append(row, emb):
+                self.flush()
+
+        except Exception as e:
+            # 以异常链保留原始堆栈，由上层决定是否记录，避免每次都格式化 traceback
+            raise MilvusFailed(f"Failed to store document: {str(e)}") from e
 
-            # 构造插入数据（不需要提供主键值）
-            data = [
-                [user_id],  # user_id
-                [kb_id],    # kb_id
-                [file_id],  # file_id
-                [headers],  # headers
-                [doc_id],   # doc_id
-                [content],  # content
-                [embedding]  # embedding
-            ]
-
-            # 插入数据到 Milvus
-            self.sess.insert(data)
-            print(f"Document {doc_id} stored successfully in collection {user_id}.")
+    def flush(self):
+        """
+        将写入缓冲区中的文档一次性插入 Milvus。store_doc 只负责缓冲，
+        一批文档写完后需调用 flush（或以 with 语句使用 MilvusClient）确保数据落库。
+        """
+        try:
+            # 失败时缓冲区同样会被清空，失败的批次不会在后续 flush 中被反复重放
+            count = self._buffer.flush()
+            if count:
+                # 写入后旧的检索结果可能已过时
+                self.query_cache.invalidate_all()
+                debug_logger.debug("stored %s documents in %s", count, self._buffer.collection.name)
 
         except Exception as e:
-            print(f'[{cur_func_name()}] [store_doc] Failed to store document: {traceback.format_exc()}')
-            raise MilvusFailed(f"Failed to store document: {str(e)}")
+            raise MilvusFailed(f"Failed to store documents: {str(e)}") from e
+
+    def discard(self):
+        """丢弃写入缓冲区中尚未写入 Milvus 的文档。"""
+        self._buffer.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # 出现异常时缓冲区中的数据可能不完整，直接丢弃而不是写入
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def __del__(self):
+        try:
+            self.flush()
+        except Exception:
+            debug_logger.error(f'[{cur_func_name()}] [MilvusClient] flush on delete failed: {traceback.format_exc()}')
 
     @get_time
-    def search_docs(self, query_embedding: List[float] = None, filter_expr: str = None, doc_limit: int = 10):
+    def search_docs(self, query_embeddings: np.ndarray = None, filter_expr: str = None, doc_limit: int = 10, *,
+                    ef: int = None, include_embedding: bool = False, collection: Collection = None):
         """
-        从 Milvus 集合中检索文档。
+        从 Milvus 集合中批量检索文档，多个查询向量只发起一次 search 请求。
 
         Args:
-            query_embedding (List[float]): 查询向量，用于基于向量相似性检索。
+            query_embeddings (np.ndarray): 形状为 (n, 768) 的查询向量矩阵，用于基于向量相似性检索，
+                传入 List[List[float]] 也会被转换为 float32 数组。
             filter_expr (str): 过滤条件表达式，用于基于字段值的过滤。如"user_id == 'abc1234'"
-            limit (int): 返回的文档数量上限，默认为 10。
+            doc_limit (int): 每个查询向量返回的文档数量上限，默认为 10。
+            ef (int): HNSW 检索时的候选队列长度。越大召回率越高但 QPS 越低，
+                默认使用 self.search_params 中的值，且至少为 doc_limit（Milvus 要求 ef >= limit）。
+                IVF 系列索引的旧集合忽略该参数，使用 self.ivf_search_params。
+            include_embedding (bool): 是否在结果中返回文档向量，默认不返回以减少传输量。
+            collection (Collection): 要检索的集合，默认为当前加载的集合。在其他线程中检索时应由调用方先取出
+                self.sess 传入，避免检索过程中 self.sess 被其他请求的 load_collection_ 切换。
 
         Returns:
-            List[dict]: 检索到的文档列表，每个文档是一个字典，包含字段值和向量。
+            List[List[dict]]: 按查询向量顺序排列的检索结果，每个元素是对应查询检索到的文档列表，
+            每个文档是一个字典，包含字段值，include_embedding 为 True 时还包含向量。
         """
         try:
-            if not self.sess:
+            # 只读取一次 self.sess，集合名、索引参数和检索都使用同一个集合
+            if collection is None:
+                collection = self.sess
+            if not collection:
                 raise MilvusFailed("Milvus collection is not loaded. Call load_collection_() first.")
+            query_embeddings = as_query_embeddings(query_embeddings, self.embedding_dim)
+            index_params = self._get_index_params(collection)
+            metric_type = index_params["metric_type"]
+            if metric_type == "IP":
+                query_embeddings = l2_normalize(query_embeddings)
+
+            # 检索的精度和性能参数、度量方式都与集合索引保持一致
+            index_type = index_params["index_type"]
+            if index_type == "HNSW":
+                params = self.search_params["params"]
+                if ef is not None or params.get("ef", doc_limit) < doc_limit:
+                    params = {**params, "ef": max(ef or 0, doc_limit)}
+            elif index_type.startswith(("IVF", "GPU_IVF")):
+                params = self.ivf_search_params
+            else:
+                params = {}
+            param = {"metric_type": metric_type, "params": params}
+
+            # 先查缓存，只对未命中的查询向量发起检索。带向量的结果体积大、复制代价高，不走缓存
+            retrieved_docs = [None] * len(query_embeddings)
+            use_cache = not include_embedding
+            miss_indexes = []
+            if use_cache:
+                make_key = QueryCache.make_key
+                collection_name = collection.name
+                cache_keys = [make_key(collection_name, emb, filter_expr, doc_limit, param)
+                              for emb in query_embeddings]
+                cache_get = self.query_cache.get
+                # 记录检索前的 generation，检索期间若有写入则不缓存本次结果
+                generation = self.query_cache.generation
+                for i, key in enumerate(cache_keys):
+                    cached = cache_get(key)
+                    if cached is None:
+                        miss_indexes.append(i)
+                    else:
+                        retrieved_docs[i] = cached
+                if not miss_indexes:
+                    return retrieved_docs
+            else:
+                miss_indexes = list(range(len(query_embeddings)))
 
-            # 构造查询参数
-            search_params = {
-                "metric_type": self.search_params["metric_type"],
-                "params": self.search_params["params"]
-            }
-
-            # 构造查询表达式
-            expr = ""
-            if filter_expr:
-                expr = filter_expr
-
-            # 构造检索参数
-            search_params.update({
-                "data": [query_embedding] if query_embedding else None,
+            # 构造检索参数，param 为检索精度/性能参数的唯一来源
+            kwargs = {
+                "data": query_embeddings[miss_indexes], # 一次请求携带全部未命中的查询向量，摊薄每次请求的固定开销
                 "anns_field": "embedding", # 指定集合中存储向量的字段名称。Milvus 会在该字段上进行向量相似性检索。
-                "param": {"metric_type": "L2", "params": {"nprobe": 128}}, # 检索的精度和性能
+                "param": param, # 检索的精度和性能
                 "limit": doc_limit, # 指定返回的最相似文档的数量上限
-                "expr": expr,
-                "output_fields": self.output_fields
-            })
+                "expr": filter_expr or "",
+                "output_fields": self.full_output_fields if include_embedding else self.default_output_fields
+            }
 
             # 执行检索
-            results = self.sess.search(**search_params)
+            results = collection.search(**kwargs)
 
-            # 处理检索结果
-            retrieved_docs = []
-            for hits in results:
-                for hit in hits:
-                    doc = {
+            # 处理检索结果，results 中每个 hits 对应一个未命中的查询向量
+            for i, hits in zip(miss_indexes, results):
+                query_docs = [
+                    {
                         # "id": hit.id,
                         # "distance": hit.distance,
-                        "user_id": hit.entity.get("user_id"),
-                        "kb_id": hit.entity.get("kb_id"),
-                        "file_id": hit.entity.get("file_id"),
-                        "headers": json.loads(hit.entity.get("headers")),
-                        "doc_id": hit.entity.get("doc_id"),
-                        "content": hit.entity.get("content"),
-                        "embedding": hit.entity.get("embedding")
+                        "user_id": e.get("user_id"),
+                        "kb_id": e.get("kb_id"),
+                        "file_id": e.get("file_id"),
+                        "headers": loads_headers(e.get("headers")),
+                        "doc_id": e.get("doc_id"),
+                        "content": e.get("content"),
+                        "embedding": e.get("embedding")  # include_embedding 为 False 时为 None
                     }
-                    retrieved_docs.append(doc)
+                    for hit in hits for e in (hit.entity,)
+                ]
+                if use_cache:
+                    self.query_cache.put(cache_keys[i], query_docs, generation)
+                retrieved_docs[i] = query_docs
 
             return retrieved_docs
 
         except Exception as e:
-            print(f'[{cur_func_name()}] [search_docs] Failed to search documents: {traceback.format_exc()}')
-            raise MilvusFailed(f"Failed to search documents: {str(e)}")
+            raise MilvusFailed(f"Failed to search documents: {str(e)}") from e
+
+    def search_doc(self, query_embedding: np.ndarray = None, filter_expr: str = None, doc_limit: int = 10, *,
+                   ef: int = None, include_embedding: bool = False, collection: Collection = None):
+        """
+        单个查询向量的检索，是 search_docs 的简单封装。
+
+        Returns:
+            List[dict]: 检索到的文档列表。
+        """
+        return self.search_docs([query_embedding], filter_expr, doc_limit,
+                                ef=ef, include_embedding=include_embedding, collection=collection)[0]
+
+    def search_docs_many(self, query_embeddings: np.ndarray, filter_expr: str = None, doc_limit: int = 10, *,
+                         ef: int = None, include_embedding: bool = False):
+        """
+        在线程池中为每个查询向量并发发起一次检索。服务端可以并行处理多个请求时，
+        吞吐量高于 search_docs 的单次批量请求。
+
+        Returns:
+            List[List[dict]]: 按查询向量顺序排列的检索结果。
+        """
+        # 在调用线程中取出当前集合，各工作线程检索同一个集合
+        search_doc = partial(self.search_doc, filter_expr=filter_expr, doc_limit=doc_limit,
+                             ef=ef, include_embedding=include_embedding, collection=self.sess)
+        return list(self.executor.map(search_doc, query_embeddings))
+
+    @get_time_async
+    async def search_docs_async(self, query_embeddings: np.ndarray = None, filter_expr: str = None,
+                                doc_limit: int = 10, *, ef: int = None, include_embedding: bool = False):
+        """
+        search_docs 的异步版本，在线程池中执行检索，不阻塞事件循环。
+        Sanic 等异步路由中需要多次检索时，可配合 asyncio.gather 让多个检索请求重叠执行，
+        总耗时接近单次检索而不是各次之和。
+
+        Returns:
+            List[List[dict]]: 按查询向量顺序排列的检索结果。
+        """
+        loop = asyncio.get_running_loop()
+        # 在事件循环线程中取出当前集合再交给工作线程，等待期间其他请求 load_collection_ 切换 self.sess
+        # 也不会检索到别的用户的集合，更不会把别人的结果写进缓存
+        collection = self.sess
+        return await loop.run_in_executor(self.executor, partial(self.search_docs, query_embeddings, filter_expr,
+                                                                 doc_limit, ef=ef, include_embedding=include_embedding,
+                                                                 collection=collection))
+
+    def _get_index_params(self, collection: Collection):
+        # 集合索引的度量方式和索引类型，未加载集合时取新建集合的默认值
+        if collection is not None:
+            index_params = MilvusClient._index_params.get(collection.name)
+            if index_params is not None:
+                return index_params
+        return {"metric_type": self.create_params["metric_type"], "index_type": self.create_params["index_type"]}
+
+    @property
+    def index_params(self):
+        return self._get_index_params(self.sess)
+
+    @property
+    def metric_type(self):
+        return self.index_params["metric_type"]
+
+    @property
+    def index_type(self):
+        return self.index_params["index_type"]
 
     @property
     def fields(self):
+        # 插入时各列的数据类型：
+        #   VARCHAR 列（user_id/kb_id/file_id/headers/doc_id/content）: 普通的 list[str]
+        #   embedding 列: list[list[float]]。pymilvus 2.4.2 的 entity_to_field_data 总是逐元素展开向量列，
+        #   直接传 ndarray 会得到逐个 np.float32 标量，反而更慢，因此 flush 中先用 ndarray.tolist() 整体转换
+        # 检索时则不同：search 的 data 传 float32 ndarray 时 pymilvus 直接 tobytes 打包，无需转换
         fields = [
             FieldSchema(name='id', dtype=DataType.INT64, is_primary=True, auto_id=True),  # 自增主键
             FieldSchema(name='user_id', dtype=DataType.VARCHAR, max_length=64),
-            FieldSchema(name='kb_id', dtype=DataType.VARCHAR, max_length=64),
+            FieldSchema(name='kb_id', dtype=DataType.VARCHAR, max_length=64, is_partition_key=True),
             FieldSchema(name='file_id', dtype=DataType.VARCHAR, max_length=64),
-            FieldSchema(name='headers', dtype=DataType.VARCHAR, max_length=256),
+            FieldSchema(name='headers', dtype=DataType.VARCHAR, max_length=self.headers_max_length),
             FieldSchema(name='doc_id', dtype=DataType.VARCHAR, max_length=64),
-            FieldSchema(name='content', dtype=DataType.VARCHAR, max_length=4000),
-            FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=768)
+            FieldSchema(name='content', dtype=DataType.VARCHAR, max_length=self.content_max_length),
+            FieldSchema(name='embedding', dtype=DataType.FLOAT_VECTOR, dim=self.embedding_dim)
         ]
         return fields
 
     @property
-    def output_fields(self):
-        return ['id', 'user_id', 'kb_id', 'file_id', 'headers', 'doc_id', 'content', 'embedding']
+    def insert_fields(self):
+        # 插入时的列顺序，与 fields 中除自增主键外的顺序一致
+        return ['user_id', 'kb_id', 'file_id', 'headers', 'doc_id', 'content', 'embedding']
+
+    @property
+    def default_output_fields(self):
+        # 默认不返回 embedding，每条结果可少传 768 维向量
+        return ['id', 'user_id', 'kb_id', 'file_id', 'headers', 'doc_id', 'content']
+
+    @property
+    def full_output_fields(self):
+        return self.default_output_fields + ['embedding']
     
 
 
@@ -216,37 +491,40 @@ def main():
         # # 执行查询
         # results = client.sess.query(
         #     expr=query_expr,
-        #     output_fields=client.output_fields,  # 指定返回的字段
+        #     output_fields=client.full_output_fields,  # 指定返回的字段
         #     limit=1000
         # )
         query_expr = embed_user_input("荷塘月色")
-        results = client.search_docs(query_expr, filter_expr, 1000)
+        results = client.search_doc(query_expr, filter_expr, 1000, include_embedding=True)
         # 打印检索结果
         if not results:
             print(f"No documents found in collection {user_id}.")
             return
 
-        print(f"Found {len(results)} documents in collection {user_id}:")
+        # 结果可能有上千条，先拼好所有行再一次性写出，避免逐行 print 反复刷新 stdout
+        lines = [f"Found {len(results)} documents in collection {user_id}:"]
         for i, result in enumerate(results):
-            print(f"\nDocument {i + 1}:")
-            print(f"  user_id: {result['user_id']}")
-            print(f"  kb_id: {result['kb_id']}")
-            print(f"  file_id: {result['file_id']}")
+            lines.append(f"\nDocument {i + 1}:")
+            lines.append(f"  user_id: {result['user_id']}")
+            lines.append(f"  kb_id: {result['kb_id']}")
+            lines.append(f"  file_id: {result['file_id']}")
             # 检查 headers 的类型
             headers = result.get('headers')
             if isinstance(headers, dict):
-                print(f"  headers: {headers}")
+                lines.append(f"  headers: {headers}")
             elif isinstance(headers, str):
                 try:
-                    headers = json.loads(headers)
-                    print(f"  headers: {headers}")
-                except json.JSONDecodeError as e:
-                    print(f"  headers: {headers} (无法解析为 JSON)")
+                    headers = orjson.loads(headers)
+                    lines.append(f"  headers: {headers}")
+                except orjson.JSONDecodeError as e:
+                    lines.append(f"  headers: {headers} (无法解析为 JSON)")
             else:
-                print(f"  headers: {headers} (未知类型)")
-            print(f"  doc_id: {result['doc_id']}")
-            print(f"  content: {result['content']}")
-            print(f"  embedding: {result['embedding'][:5]}... (truncated)")  # 只打印前 5 维向量
+                lines.append(f"  headers: {headers} (未知类型)")
+            lines.append(f"  doc_id: {result['doc_id']}")
+            lines.append(f"  content: {result['content']}")
+            lines.append(f"  embedding: {result['embedding'][:5]}... (truncated)")  # 只打印前 5 维向量
+        sys.stdout.write("\n".join(lines) + "\n")
+        sys.stdout.flush()
 
     except Exception as e:
         print(f"Failed to retrieve documents from collection {user_id}: {traceback.format_exc()}")
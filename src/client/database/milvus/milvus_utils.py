@@ -0,0 +1,181 @@
+import time
+import hashlib
+import threading
+import numpy as np
+import orjson
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class MilvusFailed(Exception):
+    """异常基类"""
+    pass
+
+
+# 大部分文档块没有 headers，空字典直接短路，省去一次编解码
+_EMPTY_HEADERS = '{}'
+
+
+def dumps_headers(headers: dict) -> str:
+    if not headers:
+        return _EMPTY_HEADERS
+    # 与 json.dumps 一致，非字符串的键转换为字符串而不是报错
+    return orjson.dumps(headers, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def loads_headers(headers: str) -> dict:
+    if not headers or headers == _EMPTY_HEADERS:
+        return {}
+    return orjson.loads(headers)
+
+
+def as_query_embeddings(query_embeddings, dim: int) -> np.ndarray:
+    """
+    将查询向量转换为形状为 (n, dim) 的连续 float32 矩阵，形状不符时报错而不是隐式 reshape。
+    """
+    if query_embeddings is None or len(query_embeddings) == 0:
+        raise MilvusFailed("query_embeddings is empty.")
+    query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+    if query_embeddings.ndim != 2 or query_embeddings.shape[-1] != dim:
+        raise MilvusFailed(f"Query embeddings shape {query_embeddings.shape} does not match (n, {dim}).")
+    return query_embeddings
+
+
+class WriteBuffer:
+    """
+    写入缓冲区，按列存放，攒够 size 条后由调用方 flush，一次性 insert 到绑定的集合。
+    向量列预先分配成 float32 矩阵逐行填充，省去逐条分配；标量列仍为 list。
+
+    Args:
+        fields (List[str]): 插入时的列顺序，其中 embedding 为向量列。
+        dim (int): 向量维度。
+        size (int): 缓冲区容量。
+    """
+    __slots__ = ('fields', 'size', 'collection', 'count', '_columns', '_embeddings')
+
+    def __init__(self, fields: List[str], dim: int, size: int = 1000):
+        self.fields = fields
+        self.size = size
+        self.collection = None
+        self.count = 0
+        self._columns = {field: [] for field in fields if field != 'embedding'}
+        self._embeddings = np.empty((size, dim), dtype=np.float32)
+
+    def bind(self, collection) -> int:
+        """
+        切换写入的目标集合。缓冲区中已有的数据属于原集合，直接丢弃而不是写入，返回丢弃的条数。
+        """
+        if collection is self.collection:
+            return 0
+        discarded = self.count
+        self.discard()
+        self.collection = collection
+        return discarded
+
+    def append(self, row: dict, embedding: np.ndarray) -> bool:
+        """加入一条数据，返回缓冲区是否已满。"""
+        for field, column in self._columns.items():
+            column.append(row[field])
+        self._embeddings[self.count] = embedding
+        self.count += 1
+        return self.count >= self.size
+
+    def flush(self) -> int:
+        """将缓冲区中的数据插入绑定的集合，返回插入的条数。"""
+        count = self.count
+        if not count:
+            return 0
+        try:
+            if self.collection is None:
+                raise MilvusFailed("Milvus collection is not loaded. Call load_collection_() first.")
+            # 按 schema 字段顺序组织成列式数据，向量列只取已填充的行，并一次性转换为 Python float 列表
+            self.collection.insert([self._columns[field] if field != 'embedding'
+                                    else self._embeddings[:count].tolist() for field in self.fields])
+        finally:
+            # 无论成功与否都清空缓冲区，失败的批次不会在后续 flush 中被反复重放
+            self.discard()
+        return count
+
+    def discard(self):
+        """丢弃缓冲区中尚未写入 Milvus 的数据。"""
+        for field in self._columns:
+            self._columns[field] = []
+        self.count = 0
+
+
+def _copy_docs(docs: List[dict]) -> List[dict]:
+    # 文档字典中只有 headers 是可变的嵌套对象，逐条浅拷贝并单独复制 headers，
+    # 代价远低于 deepcopy，调用方修改结果也不会影响缓存。embedding 不进入缓存，见 MilvusClient.search_docs
+    return [{**doc, "headers": dict(doc["headers"])} if isinstance(doc.get("headers"), dict) else dict(doc)
+            for doc in docs]
+
+
+class QueryCache:
+    """
+    线程安全的 LRU + TTL 检索结果缓存，避免相同查询重复请求 Milvus。
+
+    写入后调用 invalidate_all 使缓存整体失效并递增 generation。检索前记录 generation，
+    put 时若 generation 已变化说明检索期间发生过写入，结果可能已过时，直接丢弃不缓存。
+
+    Args:
+        max_size (int): 最多缓存的查询条数，超出后淘汰最久未使用的条目。
+        ttl_seconds (float): 缓存条目的存活时间（秒），过期后视为未命中。
+    """
+    def __init__(self, max_size: int = 1024, ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(collection_name: str, query_embedding, filter_expr: str, doc_limit: int, param: dict = None) -> bytes:
+        # 不同用户的集合互不共享缓存，因此集合名也参与计算；检索参数不同结果也可能不同
+        return hashlib.blake2b(collection_name.encode()
+                               + np.asarray(query_embedding, dtype=np.float32).tobytes()
+                               + (filter_expr or "").encode()
+                               + str(doc_limit).encode()
+                               + str(param or {}).encode()).digest()
+
+    def get(self, key: bytes) -> Optional[List[dict]]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            expire_at, value = item
+            if expire_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return _copy_docs(value)
+
+    def put(self, key: bytes, value: List[dict], generation: int = None) -> bool:
+        """
+        缓存检索结果。传入检索前记录的 generation，若期间已失效过则不缓存并返回 False。
+        """
+        value = _copy_docs(value)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            return True
+
+    def invalidate_all(self):
+        with self._lock:
+            self._data.clear()
+            self.generation += 1
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    # 归一化后内积与 L2 距离的排序一致（||q - d||^2 = 2 - 2 * q·d），但内积计算更省；
+    # 零向量保持不变。返回新数组，不修改调用方传入的向量
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
@@ -371,4 +371,10 @@ class MysqlClient:
     # [文件] 添加 chunks number 字段
     def modify_file_chunks_number(self, file_id, user_id, kb_id, chunks_number):
         query = ("UPDATE File SET chunks_number = %s WHERE file_id = %s AND user_id = %s AND kb_id = %s")
-        self.execute_query_(query, (chunks_number, file_id, user_id, kb_id), commit=True)
\ No newline at end of file
+        self.execute_query_(query, (chunks_number, file_id, user_id, kb_id), commit=True)
+
+    # [文件] 软删除指定知识库下面的文件，同名文件之后可以重新上传
+    def delete_files(self, kb_id, file_ids):
+        placeholders = ','.join(['%s'] * len(file_ids))
+        query = "UPDATE File SET deleted = 1 WHERE kb_id = %s AND file_id IN ({})".format(placeholders)
+        self.execute_query_(query, [kb_id] + list(file_ids), commit=True)
\ No newline at end of file
@@ -3,6 +3,7 @@ import sys
 import os
 
 import urllib
+import traceback
 # 获取当前脚本的绝对路径
 current_script_path = os.path.abspath(__file__)
 
@@ -149,6 +150,7 @@ async def upload_files(req: request):
     timestamp = now.strftime("%Y%m%d%H%M")
 
     failed_files = []
+    store_failed_files = []
     record_exist_files = []
     for file, file_name in zip(files, file_names):
         # 对于数据库中同名文件直接跳过，不保存到本地服务器上
@@ -186,11 +188,26 @@ async def upload_files(req: request):
         parent_chunk_number = len(set(doc.metadata["doc_id"] for doc in file_handler.docs)) # file_handler.docs 列表中每个元素 doc 的不重复的 doc.doc_id 数量
         # TODO 将切分好的Document存入向量数据库中
         qa_handler.milvus_kb.load_collection_(user_id)
-        for doc in file_handler.docs:
-            textvec = qa_handler.embeddings.embed_query(doc.page_content)
-            # print(textvec)
-            file_handler.embs.append(textvec)
-            qa_handler.milvus_kb.store_doc(doc, textvec)
+        try:
+            for doc in file_handler.docs:
+                textvec = qa_handler.embeddings.embed_query(doc.page_content)
+                # print(textvec)
+                file_handler.embs.append(textvec)
+                qa_handler.milvus_kb.store_doc(doc, textvec)
+            # store_doc 只写入缓冲区，文件处理完后统一落库
+            qa_handler.milvus_kb.flush()
+        except Exception as e:
+            debug_logger.error(f"fail, store {file_name} to milvus failed: {traceback.format_exc()}")
+            store_failed_files.append(file_name)
+            # 丢弃缓冲区中尚未落库的文档块；缓冲区满时 store_doc 已自动落库的部分按 file_id 删除，
+            # 并软删除 mysql 中的文件记录，否则 soft 模式下重试会被当作同名文件跳过
+            qa_handler.milvus_kb.discard()
+            try:
+                qa_handler.milvus_kb.delete_files([file_id])
+                qa_handler.milvus_summary.delete_files(kb_id, [file_id])
+            except Exception as e:
+                debug_logger.error(f"fail, clean up {file_name} failed: {traceback.format_exc()}")
+            continue
         # 向量数据库存 向量数据库搜索
         print(file_handler.docs)
         # TODO：存入完以后更新mysql中file表的chunks_number，状态之类的后面再说吧，先把关键的增删改查写了
@@ -203,6 +220,8 @@ async def upload_files(req: request):
     # asyncio.create_task(local_doc_qa.insert_files_to_milvus(user_id, kb_id, local_files))
     if failed_files:
         msg = f"warning, {failed_files} chars is too much, max characters length is {MAX_CHARS}, skip upload."
+    elif store_failed_files:
+        msg = f"warning, {store_failed_files} failed to store, please retry."
     elif record_exist_files:
         msg = f"warning, {record_exist_files} exist in {user_id} and {kb_id}, skip upload."
     else:
@@ -0,0 +1,183 @@
+import numpy as np
+import pytest
+
+from src.client.database.milvus import milvus_utils
+from src.client.database.milvus.milvus_utils import MilvusFailed, QueryCache, WriteBuffer, l2_normalize, \
+    as_query_embeddings, dumps_headers, loads_headers
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(milvus_utils.time, "monotonic", lambda: now[0])
+    return now
+
+
+class FakeCollection:
+    def __init__(self, name="c1", fail=False):
+        self.name = name
+        self.fail = fail
+        self.inserted = []
+
+    def insert(self, data):
+        if self.fail:
+            raise RuntimeError("insert failed")
+        self.inserted.append(data)
+
+
+FIELDS = ['user_id', 'doc_id', 'embedding']
+
+
+def make_buffer(collection, size=2):
+    buffer = WriteBuffer(FIELDS, dim=2, size=size)
+    buffer.bind(collection)
+    return buffer
+
+
+def test_query_cache_hit_and_miss_counts():
+    cache = QueryCache(max_size=4, ttl_seconds=60)
+    assert cache.get(b"a") is None
+    cache.put(b"a", [{"doc_id": "1"}])
+    assert cache.get(b"a") == [{"doc_id": "1"}]
+    assert cache.get(b"b") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_query_cache_evicts_least_recently_used():
+    cache = QueryCache(max_size=2, ttl_seconds=60)
+    cache.put(b"a", [])
+    cache.put(b"b", [])
+    cache.get(b"a")  # a 变为最近使用，b 应被淘汰
+    cache.put(b"c", [])
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == []
+    assert cache.get(b"c") == []
+
+
+def test_query_cache_ttl_expiry(clock):
+    cache = QueryCache(max_size=4, ttl_seconds=10)
+    cache.put(b"a", [{"doc_id": "1"}])
+    clock[0] += 9
+    assert cache.get(b"a") is not None
+    clock[0] += 2
+    assert cache.get(b"a") is None
+    assert cache.misses == 1
+
+
+def test_query_cache_copies_docs_and_headers():
+    cache = QueryCache()
+    docs = [{"doc_id": "1", "headers": {"h1": "a"}}]
+    cache.put(b"a", docs)
+    docs[0]["headers"]["h1"] = "changed"
+    docs[0]["doc_id"] = "2"
+    hit = cache.get(b"a")
+    hit[0]["headers"]["h2"] = "b"
+    hit[0]["score"] = 1.0
+    assert cache.get(b"a") == [{"doc_id": "1", "headers": {"h1": "a"}}]
+
+
+def test_query_cache_skips_put_after_invalidation():
+    cache = QueryCache()
+    generation = cache.generation
+    cache.invalidate_all()  # 检索期间发生写入
+    assert cache.put(b"a", [{"doc_id": "1"}], generation) is False
+    assert cache.get(b"a") is None
+    assert cache.put(b"a", [{"doc_id": "1"}], cache.generation) is True
+
+
+def test_query_cache_key_depends_on_inputs():
+    key = QueryCache.make_key("c1", [0.1, 0.2], "kb_id == 'x'", 10, {"ef": 64})
+    assert key == QueryCache.make_key("c1", [0.1, 0.2], "kb_id == 'x'", 10, {"ef": 64})
+    assert key != QueryCache.make_key("c2", [0.1, 0.2], "kb_id == 'x'", 10, {"ef": 64})
+    assert key != QueryCache.make_key("c1", [0.1, 0.2], "kb_id == 'x'", 20, {"ef": 64})
+    assert key != QueryCache.make_key("c1", [0.1, 0.2], "kb_id == 'x'", 10, {"ef": 128})
+
+
+def test_l2_normalize_returns_unit_vectors_without_mutating_input():
+    vectors = np.array([[3.0, 4.0], [0.0, 0.0]], dtype=np.float32)
+    normalized = l2_normalize(vectors)
+    assert normalized.dtype == np.float32
+    np.testing.assert_allclose(normalized, [[0.6, 0.8], [0.0, 0.0]], rtol=1e-6)
+    np.testing.assert_array_equal(vectors, [[3.0, 4.0], [0.0, 0.0]])
+    np.testing.assert_allclose(l2_normalize(np.array([0.0, 2.0])), [0.0, 1.0])
+
+
+def test_ip_ranking_matches_l2_ranking_for_normalized_vectors():
+    rng = np.random.default_rng(0)
+    docs = l2_normalize(rng.normal(size=(2000, 768)).astype(np.float32))
+    queries = l2_normalize(rng.normal(size=(20, 768)).astype(np.float32))
+    l2 = ((queries[:, None, :] - docs[None, :, :]) ** 2).sum(axis=-1)
+    ip = queries @ docs.T
+    for i in range(len(queries)):
+        np.testing.assert_array_equal(np.argsort(l2[i])[:50], np.argsort(-ip[i])[:50])
+
+
+def test_write_buffer_reports_full_and_flushes_columns():
+    collection = FakeCollection()
+    buffer = make_buffer(collection)
+    assert buffer.append({'user_id': 'u', 'doc_id': '1'}, [0.1, 0.2]) is False
+    assert buffer.append({'user_id': 'u', 'doc_id': '2'}, [0.3, 0.4]) is True
+    assert buffer.flush() == 2
+    (data,) = collection.inserted
+    assert data[:2] == [['u', 'u'], ['1', '2']]
+    np.testing.assert_allclose(data[2], [[0.1, 0.2], [0.3, 0.4]], rtol=1e-6)
+    assert isinstance(data[2][0][0], float)
+    assert buffer.count == 0
+    assert buffer.flush() == 0
+    assert len(collection.inserted) == 1
+
+
+def test_write_buffer_discards_batch_when_insert_fails():
+    collection = FakeCollection(fail=True)
+    buffer = make_buffer(collection)
+    buffer.append({'user_id': 'u', 'doc_id': '1'}, [0.1, 0.2])
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.count == 0
+    # 失败的批次不会在下一次 flush 中重放
+    collection.fail = False
+    buffer.append({'user_id': 'u', 'doc_id': '2'}, [0.3, 0.4])
+    buffer.flush()
+    assert collection.inserted[0][1] == ['2']
+
+
+def test_write_buffer_rebind_discards_without_insert():
+    old, new = FakeCollection("c1"), FakeCollection("c2")
+    buffer = make_buffer(old)
+    buffer.append({'user_id': 'u', 'doc_id': '1'}, [0.1, 0.2])
+    assert buffer.bind(old) == 0
+    assert buffer.count == 1
+    assert buffer.bind(new) == 1
+    assert buffer.count == 0
+    assert buffer.flush() == 0
+    assert old.inserted == [] and new.inserted == []
+
+
+def test_write_buffer_flush_without_collection_fails():
+    buffer = WriteBuffer(FIELDS, dim=2)
+    buffer.append({'user_id': 'u', 'doc_id': '1'}, [0.1, 0.2])
+    with pytest.raises(MilvusFailed):
+        buffer.flush()
+    assert buffer.count == 0
+
+
+@pytest.mark.parametrize("query_embeddings", [None, [], np.zeros(768), np.zeros((2, 512)), np.zeros((1, 2, 768))])
+def test_as_query_embeddings_rejects_wrong_shape(query_embeddings):
+    with pytest.raises(MilvusFailed):
+        as_query_embeddings(query_embeddings, 768)
+
+
+def test_as_query_embeddings_returns_contiguous_float32():
+    query_embeddings = as_query_embeddings([[1, 2, 3]], 3)
+    assert query_embeddings.dtype == np.float32
+    assert query_embeddings.shape == (1, 3)
+    assert query_embeddings.flags['C_CONTIGUOUS']
+
+
+def test_headers_round_trip():
+    assert dumps_headers({}) == '{}'
+    assert dumps_headers(None) == '{}'
+    assert loads_headers('') == {}
+    assert loads_headers(dumps_headers({'h1': '标题'})) == {'h1': '标题'}
+    # 非字符串的键与 json.dumps 一致转换为字符串
+    assert loads_headers(dumps_headers({1: 'a', 'h2': 'b'})) == {'1': 'a', 'h2': 'b'}